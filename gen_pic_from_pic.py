@@ -3,6 +3,8 @@
 支持参考图生成图片
 '''
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import hashlib
 import hmac
@@ -10,16 +12,36 @@ import uuid
 import time
 import random
 import os
-from typing import Dict, List, Optional, Union
+import stat
+import threading
+from typing import Dict, Iterator, List, Optional, Union
 from urllib.parse import urlencode, quote
 import binascii
+import zlib
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-# 第三方依赖：需要安装 pip install requests crcmod
+# 第三方依赖：需要安装 pip install requests
+# 可选依赖：安装 orjson 可加速 JSON 序列化 pip install orjson
 try:
-    import crcmod
+    import orjson
 except ImportError:
-    raise ImportError("请安装 crcmod 库: pip install crcmod")
+    orjson = None
+# 可选依赖：安装 httpx 后接口请求走 HTTP/2 pip install "httpx[http2]"
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 请求失败时需要统一转换的异常类型；ValueError 覆盖响应体不是 JSON 的情况
+_HTTP_ERRORS = (requests.exceptions.RequestException, ValueError) + ((httpx.HTTPError,) if httpx else ())
+
+
+def _json_dumps(obj) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON，有 orjson 时优先使用"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 
 class JimengApiClient:
@@ -39,8 +61,109 @@ class JimengApiClient:
     # 常量定义
     DEFAULT_MODEL = 'jimeng-3.1'
     DEFAULT_BLEND_MODEL = 'jimeng-3.0'
+    DEFAULT_MODEL_VALUE = MODEL_MAP[DEFAULT_MODEL]
+    DEFAULT_BLEND_MODEL_VALUE = MODEL_MAP[DEFAULT_BLEND_MODEL]
     DRAFT_VERSION = '3.0.2'
     DEFAULT_ASSISTANT_ID = '513695'
+    ASSISTANT_AID = int(DEFAULT_ASSISTANT_ID)
+    SIGNING_KEY_CACHE_SIZE = 16
+    COOKIE_REFRESH_INTERVAL = 3600
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    # 连接池与重试配置：连接失败对所有请求重试；网关错误（RETRY_STATUS_CODES）
+    # 只对 GET 与显式标记为幂等的请求重试，避免重复提交生成、重复扣积分
+    POOL_SIZE = 20
+    MAX_RETRIES = 3
+    RETRY_BACKOFF_FACTOR = 0.3
+    RETRY_STATUS_CODES = (502, 503, 504)
+    # 连接预热的超时（秒），预热失败不影响正常请求
+    PREWARM_TIMEOUT = 3
+    # 结果轮询间隔（秒）
+    POLL_INITIAL_INTERVAL = 1.5
+    POLL_BACKOFF_FACTOR = 1.3
+    POLL_MAX_INTERVAL = 5.0
+    # 结果轮询的总等待上限（秒），超出后放弃；None 表示一直等待到生成结束
+    POLL_TIMEOUT: Optional[float] = None
+    
+    # 结果查询时请求的图片规格
+    IMAGE_SCENE_LIST = (
+        {"scene": "smart_crop", "width": 360, "height": 360, "uniq_key": "smart_crop-w:360-h:360", "format": "webp"},
+        {"scene": "smart_crop", "width": 480, "height": 480, "uniq_key": "smart_crop-w:480-h:480", "format": "webp"},
+        {"scene": "smart_crop", "width": 720, "height": 720, "uniq_key": "smart_crop-w:720-h:720", "format": "webp"},
+        {"scene": "smart_crop", "width": 720, "height": 480, "uniq_key": "smart_crop-w:720-h:480", "format": "webp"},
+        {"scene": "smart_crop", "width": 360, "height": 240, "uniq_key": "smart_crop-w:360-h:240", "format": "webp"},
+        {"scene": "smart_crop", "width": 240, "height": 320, "uniq_key": "smart_crop-w:240-h:320", "format": "webp"},
+        {"scene": "smart_crop", "width": 480, "height": 640, "uniq_key": "smart_crop-w:480-h:640", "format": "webp"},
+        {"scene": "normal", "width": 2400, "height": 2400, "uniq_key": "2400", "format": "webp"},
+        {"scene": "normal", "width": 1080, "height": 1080, "uniq_key": "1080", "format": "webp"},
+        {"scene": "normal", "width": 720, "height": 720, "uniq_key": "720", "format": "webp"},
+        {"scene": "normal", "width": 480, "height": 480, "uniq_key": "480", "format": "webp"},
+        {"scene": "normal", "width": 360, "height": 360, "uniq_key": "360", "format": "webp"},
+    )
+    HISTORY_IMAGE_INFO = {
+        "width": 2048,
+        "height": 2048,
+        "format": "webp",
+        "image_scene_list": IMAGE_SCENE_LIST
+    }
+    HISTORY_COMMON_INFO = {
+        "aid": ASSISTANT_AID
+    }
+    
+    # 生成请求中固定不变的片段，类加载时构建一次
+    BLEND_BABI_PARAM = quote(_json_dumps({
+        "scenario": "image_video_generation",
+        "feature_key": "to_image_referenceimage_generate",
+        "feature_entrance": "to_image",
+        "feature_entrance_detail": "to_image-referenceimage-byte_edit",
+    }))
+    BLEND_LARGE_IMAGE_INFO = {
+        "height": 1360,
+        "width": 1360,
+        "resolution_type": '1k'
+    }
+    METRICS_EXTRA = _json_dumps({
+        "templateId": "",
+        "generateCount": 1,
+        "promptSource": "custom",
+        "templateSource": "",
+        "lastRequestId": "",
+        "originRequestId": "",
+    }).decode('utf-8')
+    
+    # 空请求体的 SHA-256
+    EMPTY_SHA256 = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+    
+    # 伪造的请求头（只读）
+    FAKE_HEADERS = (
+        ("Accept", "application/json, text/plain, */*"),
+        ("Accept-Encoding", "gzip, deflate, br, zstd"),
+        ("Accept-Language", "zh-CN,zh;q=0.9"),
+        ("Cache-Control", "no-cache"),
+        ("Last-Event-Id", "undefined"),
+        ("Appid", DEFAULT_ASSISTANT_ID),
+        ("Appvr", "5.8.0"),
+        ("Origin", "https://jimeng.jianying.com"),
+        ("Pragma", "no-cache"),
+        ("Priority", "u=1, i"),
+        ("Referer", "https://jimeng.jianying.com"),
+        ("Pf", "7"),
+        ("Sec-Ch-Ua", '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"'),
+        ("Sec-Ch-Ua-Mobile", "?0"),
+        ("Sec-Ch-Ua-Platform", '"Windows"'),
+        ("Sec-Fetch-Dest", "empty"),
+        ("Sec-Fetch-Mode", "cors"),
+        ("Sec-Fetch-Site", "same-origin"),
+        ("User-Agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"),
+    )
+    
+    # 请求第三方地址（远程图片、上传服务器）时覆盖会话请求头：
+    # 去掉伪造的即梦来源头与 Cookie，只保留 User-Agent，避免被防盗链拒绝
+    THIRD_PARTY_HEADERS = {
+        **{key: None for key, _ in FAKE_HEADERS if key != "User-Agent"},
+        "Accept": "*/*",
+        "Accept-Encoding": "gzip, deflate",
+        "Cookie": None,
+    }
     
     def __init__(self, refresh_token: Optional[str] = None):
         """
@@ -53,79 +176,176 @@ class JimengApiClient:
         if not self.refresh_token:
             raise ValueError('JIMENG_API_TOKEN 环境变量未设置或未提供 refresh_token')
         
-        self.web_id = random.random() * 999999999999999999 + 7000000000000000000
-        self.user_id = str(uuid.uuid4()).replace('-', '')
+        self.web_id = random.randint(7_000_000_000_000_000_000, 7_999_999_999_999_999_999)
+        self.user_id = uuid.uuid4().hex
         self.upload_image_proof_url = 'https://imagex.bytedanceapi.com/'
         
-        # 设置会话
-        self.session = requests.Session()
-        self.session.headers.update(self._get_fake_headers())
-    
-    def _get_fake_headers(self) -> Dict[str, str]:
-        """获取伪造的请求头"""
-        return {
-            "Accept": "application/json, text/plain, */*",
-            "Accept-Encoding": "gzip, deflate, br, zstd",
-            "Accept-Language": "zh-CN,zh;q=0.9",
-            "Cache-Control": "no-cache",
-            "Last-Event-Id": "undefined",
-            "Appid": self.DEFAULT_ASSISTANT_ID,
-            "Appvr": "5.8.0",
-            "Origin": "https://jimeng.jianying.com",
-            "Pragma": "no-cache",
-            "Priority": "u=1, i",
-            "Referer": "https://jimeng.jianying.com",
-            "Pf": "7",
-            "Sec-Ch-Ua": '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-            "Sec-Ch-Ua-Mobile": "?0",
-            "Sec-Ch-Ua-Platform": '"Windows"',
-            "Sec-Fetch-Dest": "empty",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Site": "same-origin",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-        }
-    
-    def _generate_cookie(self) -> str:
-        """生成Cookie"""
-        timestamp = int(time.time())
-        cookie_parts = [
+        # Cookie 中只有 sid_guard 的时间戳会变化，其余部分预先拼好
+        # sid_guard 的有效期为 5184000 秒，时间戳无需每次请求都更新
+        self._cookie_prefix = "; ".join([
             f"_tea_web_id={self.web_id}",
             "is_staff_user=false",
             "store-region=cn-gd",
             "store-region-src=uid",
-            f"sid_guard={self.refresh_token}%7C{timestamp}%7C5184000%7CMon%2C+03-Feb-2025+08%3A17%3A09+GMT",
+            f"sid_guard={self.refresh_token}%7C",
+        ])
+        self._cookie_suffix = "; ".join([
+            "%7C5184000%7CMon%2C+03-Feb-2025+08%3A17%3A09+GMT",
             f"uid_tt={self.user_id}",
             f"uid_tt_ss={self.user_id}",
             f"sid_tt={self.refresh_token}",
             f"sessionid={self.refresh_token}",
             f"sessionid_ss={self.refresh_token}",
-            f"sid_tt={self.refresh_token}"
-        ]
-        return "; ".join(cookie_parts)
+        ])
+        self._cookie_cache = (0, '')
+        
+        # SigV4 signingKey 缓存，键为 (secret_access_key, 日期, region, service)
+        # 值为已用 signingKey 初始化的 HMAC 对象，签名时 copy 后复用
+        self._signing_key_cache: Dict[tuple, 'hmac.HMAC'] = {}
+        
+        # 设置会话，复用连接池（即梦与 imagex 上传域名共享长连接）
+        # 连接失败对所有方法重试，网关错误只对 GET 重试；幂等 POST 的网关错误由 _request 重试
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.POOL_SIZE,
+            pool_maxsize=self.POOL_SIZE,
+            max_retries=Retry(
+                total=self.MAX_RETRIES,
+                backoff_factor=self.RETRY_BACKOFF_FACTOR,
+                status_forcelist=self.RETRY_STATUS_CODES,
+                allowed_methods=frozenset(['GET']),
+            ),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(self._get_fake_headers())
+        self.session.headers['Connection'] = 'keep-alive'
+        
+        # 可用时接口请求走 HTTP/2，多次轮询共享一条连接并压缩重复的请求头
+        # httpx 的 retries 只覆盖连接失败，网关错误统一由 _request 重试
+        self.http2_client = None
+        if httpx is not None:
+            try:
+                transport = httpx.HTTPTransport(
+                    http2=True,
+                    retries=self.MAX_RETRIES,
+                    limits=httpx.Limits(max_connections=self.POOL_SIZE),
+                )
+                # 与 requests 一致，自动跟随重定向
+                self.http2_client = httpx.Client(
+                    transport=transport,
+                    timeout=30,
+                    follow_redirects=True,
+                    headers=self._get_fake_headers(),
+                )
+            except ImportError:
+                # 未安装 h2，继续使用 requests 会话
+                pass
+        
+        # 生成图片时并行查询积分的线程池，首次使用时创建
+        self._executor: Optional[ThreadPoolExecutor] = None
+        
+        # 后台预热 imagex 连接，首次上传时免去握手；守护线程不会阻塞进程退出
+        threading.Thread(target=self._prewarm_connections, daemon=True).start()
+    
+    def _prewarm_connections(self) -> None:
+        """预先建立到 imagex 的连接，失败时忽略"""
+        try:
+            if self.http2_client is not None:
+                self.http2_client.head(self.upload_image_proof_url, timeout=self.PREWARM_TIMEOUT)
+            else:
+                self.session.head(
+                    self.upload_image_proof_url,
+                    headers=self.THIRD_PARTY_HEADERS,
+                    timeout=self.PREWARM_TIMEOUT,
+                )
+        except Exception:
+            pass
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """获取后台线程池，关闭后再次使用时重新创建"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+    
+    def close(self) -> None:
+        """
+        关闭会话，释放连接池与后台线程
+        
+        关闭后客户端仍可继续使用：线程池按需重建，接口请求改走 requests 会话
+        """
+        executor = getattr(self, '_executor', None)
+        if executor is not None:
+            self._executor = None
+            executor.shutdown(wait=False)
+        session = getattr(self, 'session', None)
+        if session is not None:
+            session.close()
+        http2_client = getattr(self, 'http2_client', None)
+        if http2_client is not None:
+            # httpx 客户端关闭后不可再用
+            self.http2_client = None
+            http2_client.close()
+    
+    def __enter__(self) -> 'JimengApiClient':
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+    
+    def __del__(self):
+        self.close()
+    
+    def _get_fake_headers(self) -> Dict[str, str]:
+        """获取伪造的请求头"""
+        return dict(self.FAKE_HEADERS)
+    
+    def _generate_cookie(self) -> str:
+        """生成Cookie，COOKIE_REFRESH_INTERVAL 内复用上次结果"""
+        timestamp = int(time.time())
+        if timestamp - self._cookie_cache[0] < self.COOKIE_REFRESH_INTERVAL:
+            return self._cookie_cache[1]
+        
+        cookie = f"{self._cookie_prefix}{timestamp}{self._cookie_suffix}"
+        self._cookie_cache = (timestamp, cookie)
+        return cookie
+    
+    def _refresh_session_cookie(self) -> None:
+        """Cookie 重新生成后写入会话请求头"""
+        cookie = self._generate_cookie()
+        if self.session.headers.get('Cookie') is not cookie:
+            self.session.headers['Cookie'] = cookie
+            if self.http2_client is not None:
+                self.http2_client.headers['Cookie'] = cookie
     
     def _get_model(self, model: str) -> str:
         """获取模型映射"""
-        return self.MODEL_MAP.get(model, self.MODEL_MAP[self.DEFAULT_MODEL])
+        return self.MODEL_MAP.get(model, self.DEFAULT_MODEL_VALUE)
     
-    def _generate_uuid(self) -> str:
-        """生成UUID"""
-        return str(uuid.uuid4())
+    def _uuid_iter(self, batch_size: int = 16) -> Iterator[str]:
+        """批量生成UUID，每批只读取一次系统随机数"""
+        while True:
+            random_bytes = os.urandom(16 * batch_size)
+            for i in range(0, len(random_bytes), 16):
+                yield str(uuid.UUID(bytes=random_bytes[i:i + 16], version=4))
     
     def _unix_timestamp(self) -> int:
         """获取Unix时间戳"""
         return int(time.time())
     
-    def _request(self, method: str, path: str, data: Optional[Dict] = None, 
-                params: Optional[Dict] = None, headers: Optional[Dict] = None) -> Dict:
+    def _request(self, method: str, path: str, data: Optional[Union[Dict, str, bytes]] = None, 
+                params: Optional[Dict] = None, headers: Optional[Dict] = None,
+                idempotent: bool = False) -> Dict:
         """
         发送请求到即梦API
         
         Args:
             method: 请求方法
             path: 请求路径
-            data: 请求数据
+            data: 请求数据，str/bytes 视为已序列化的JSON
             params: 请求参数
             headers: 请求头
+            idempotent: 请求可安全重放，遇到网关错误时重试（GET 总是视为幂等）
             
         Returns:
             响应结果
@@ -133,26 +353,52 @@ class JimengApiClient:
         base_url = 'https://jimeng.jianying.com'
         url = path if path.startswith('https://') else f"{base_url}{path}"
         
-        request_headers = {
-            'Cookie': self._generate_cookie(),
-            **(headers or {})
-        }
+        # Cookie 挂在会话请求头上，这里只传每次调用不同的请求头
+        self._refresh_session_cookie()
+        request_headers = headers
+        
+        if method.upper() == 'GET':
+            params = {**(data or {}), **(params or {})}
+            data = None
+        elif data:
+            # 自行序列化请求体，与签名时计算摘要的字节保持一致
+            if not isinstance(data, (str, bytes)):
+                data = _json_dumps(data)
+            request_headers = {'Content-Type': 'application/json', **(headers or {})}
+        else:
+            # 空请求体不做序列化
+            data = None
+        
+        retry_status = idempotent or method.upper() == 'GET'
         
         try:
-            if method.upper() == 'GET':
-                response = self.session.get(url, params={**(data or {}), **(params or {})}, headers=request_headers)
-            else:
-                response = self.session.request(
-                    method.lower(), 
-                    url, 
-                    json=data, 
-                    params=params, 
-                    headers=request_headers
-                )
+            for attempt in range(self.MAX_RETRIES + 1):
+                if self.http2_client is not None:
+                    # 空参数不传，避免 httpx 重新编码已签名的查询串
+                    response = self.http2_client.request(
+                        method.upper(), 
+                        url, 
+                        content=data, 
+                        params=params or None, 
+                        headers=request_headers
+                    )
+                else:
+                    response = self.session.request(
+                        method.lower(), 
+                        url, 
+                        data=data, 
+                        params=params, 
+                        headers=request_headers
+                    )
+                
+                if (not retry_status or attempt == self.MAX_RETRIES
+                        or response.status_code not in self.RETRY_STATUS_CODES):
+                    break
+                time.sleep(self.RETRY_BACKOFF_FACTOR * (2 ** attempt))
             
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except _HTTP_ERRORS as e:
             raise Exception(f"即梦API请求失败: {str(e)}")
     
     def get_credit(self) -> Dict[str, int]:
@@ -167,7 +413,8 @@ class JimengApiClient:
             '/commerce/v1/benefits/user_credit',
             {},
             {},
-            {'Referer': 'https://jimeng.jianying.com/ai-tool/image/generate'}
+            {'Referer': 'https://jimeng.jianying.com/ai-tool/image/generate'},
+            idempotent=True
         )
         
         credit = result.get('credit', {})
@@ -192,21 +439,40 @@ class JimengApiClient:
             {'Referer': 'https://jimeng.jianying.com/ai-tool/image/generate'}
         )
     
-    def _get_file_content(self, file_path: str) -> bytes:
-        """获取文件内容"""
+    def _get_file_content(self, file_path: str) -> Union[bytes, str]:
+        """获取文件内容，远程图片返回字节，本地文件返回路径以便流式读取"""
         try:
             if file_path.startswith(('http://', 'https://')):
-                # 从URL获取图片
-                response = requests.get(file_path)
+                # 从URL获取图片，第三方地址不携带即梦的请求头与 Cookie
+                response = self.session.get(file_path, headers=self.THIRD_PARTY_HEADERS)
                 response.raise_for_status()
                 return response.content
             else:
-                # 从本地文件获取
-                with open(file_path, 'rb') as f:
-                    return f.read()
+                # 本地文件不整体读入内存，只预先检查能否读取，保留系统给出的错误原因
+                if not stat.S_ISREG(os.stat(file_path).st_mode):
+                    raise OSError(f"不是普通文件: {file_path}")
+                with open(file_path, 'rb'):
+                    pass
+                return file_path
         except Exception as e:
             raise Exception(f"读取文件失败: {file_path}, 错误: {str(e)}")
     
+    def _file_size_and_crc32(self, file_path: str) -> tuple:
+        """分块读取本地文件，计算文件大小与CRC32"""
+        file_size = 0
+        crc32 = 0
+        try:
+            with open(file_path, 'rb') as f:
+                while True:
+                    chunk = f.read(self.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file_size += len(chunk)
+                    crc32 = zlib.crc32(chunk, crc32)
+        except OSError as e:
+            raise Exception(f"读取文件失败: {file_path}, 错误: {str(e)}")
+        return file_size, crc32 & 0xFFFFFFFF
+    
     def _generate_random_string(self, length: int) -> str:
         """生成随机字符串"""
         characters = 'abcdefghijklmnopqrstuvwxyz0123456789'
@@ -217,7 +483,8 @@ class JimengApiClient:
         auth_res = self._request(
             'POST',
             '/mweb/v1/get_upload_token?aid=513695&da_version=3.2.2&aigc_features=app_lip_sync',
-            {'scene': 2}
+            {'scene': 2},
+            idempotent=True
         )
         
         if not auth_res.get('data'):
@@ -225,7 +492,14 @@ class JimengApiClient:
         
         return auth_res['data']
     
-    def _add_headers(self, amz_date: str, session_token: str, request_body: Dict) -> Dict:
+    def _payload_hash(self, request_body: Dict) -> str:
+        """计算请求体的SHA-256，空请求体直接返回常量"""
+        if not request_body:
+            return self.EMPTY_SHA256
+        return hashlib.sha256(_json_dumps(request_body)).hexdigest()
+    
+    def _add_headers(self, amz_date: str, session_token: str, request_body: Dict,
+                     payload_hash: Optional[str] = None) -> Dict:
         """生成请求所需Header"""
         headers = {
             'X-Amz-Date': amz_date,
@@ -233,9 +507,7 @@ class JimengApiClient:
         }
         
         if request_body:
-            headers['X-Amz-Content-Sha256'] = hashlib.sha256(
-                json.dumps(request_body).encode('utf-8')
-            ).hexdigest()
+            headers['X-Amz-Content-Sha256'] = payload_hash or self._payload_hash(request_body)
         
         return headers
     
@@ -254,8 +526,14 @@ class JimengApiClient:
         headers = [key.lower() for key in request_headers.keys()]
         return ';'.join(sorted(headers))
     
+    def _canonical_query_string(self, request_params: Dict) -> str:
+        """生成canonical查询串：参数按键排序，空格编码为%20"""
+        return urlencode(sorted(request_params.items()), quote_via=quote)
+    
     def _canonical_string(self, request_method: str, request_params: Dict, 
-                         request_headers: Dict, request_body: Dict) -> str:
+                         request_headers: Dict, request_body: Dict,
+                         payload_hash: Optional[str] = None,
+                         canonical_query_string: Optional[str] = None) -> str:
         """生成canonicalString"""
         # 生成canonical headers
         canonical_headers = []
@@ -264,34 +542,53 @@ class JimengApiClient:
         canonical_headers_str = '\n'.join(canonical_headers) + '\n'
         
         # 处理请求体
-        body = json.dumps(request_body) if request_body else ''
+        if payload_hash is None:
+            payload_hash = self._payload_hash(request_body)
+        
+        if canonical_query_string is None:
+            canonical_query_string = self._canonical_query_string(request_params)
         
         canonical_string_arr = [
             request_method.upper(),
             '/',
-            urlencode(request_params),
+            canonical_query_string,
             canonical_headers_str,
             self._signed_headers(request_headers),
-            hashlib.sha256(body.encode('utf-8')).hexdigest(),
+            payload_hash,
         ]
         
         return '\n'.join(canonical_string_arr)
     
+    def _signing_hmac(self, secret_access_key: str, amz_day: str, region: str, service: str) -> 'hmac.HMAC':
+        """获取以signingKey为密钥的HMAC对象，同一凭证同一天内只派生一次"""
+        cache_key = (secret_access_key, amz_day, region, service)
+        signing_hmac = self._signing_key_cache.get(cache_key)
+        if signing_hmac is None:
+            k_date = hmac.new(
+                f'AWS4{secret_access_key}'.encode('utf-8'),
+                amz_day.encode('utf-8'),
+                hashlib.sha256
+            ).digest()
+            
+            k_region = hmac.new(k_date, region.encode('utf-8'), hashlib.sha256).digest()
+            k_service = hmac.new(k_region, service.encode('utf-8'), hashlib.sha256).digest()
+            signing_key = hmac.new(k_service, 'aws4_request'.encode('utf-8'), hashlib.sha256).digest()
+            signing_hmac = hmac.new(signing_key, digestmod=hashlib.sha256)
+            
+            # 每次上传都会拿到新凭证，避免缓存无限增长
+            if len(self._signing_key_cache) >= self.SIGNING_KEY_CACHE_SIZE:
+                self._signing_key_cache.clear()
+            self._signing_key_cache[cache_key] = signing_hmac
+        return signing_hmac
+    
     def _signature(self, secret_access_key: str, amz_date: str, region: str, 
                   service: str, request_method: str, request_params: Dict,
-                  request_headers: Dict, request_body: Dict) -> str:
+                  request_headers: Dict, request_body: Dict,
+                  payload_hash: Optional[str] = None,
+                  canonical_query_string: Optional[str] = None) -> str:
         """生成签名"""
-        # 生成signingKey
-        amz_day = amz_date[:8]
-        k_date = hmac.new(
-            f'AWS4{secret_access_key}'.encode('utf-8'),
-            amz_day.encode('utf-8'),
-            hashlib.sha256
-        ).digest()
-        
-        k_region = hmac.new(k_date, region.encode('utf-8'), hashlib.sha256).digest()
-        k_service = hmac.new(k_region, service.encode('utf-8'), hashlib.sha256).digest()
-        signing_key = hmac.new(k_service, 'aws4_request'.encode('utf-8'), hashlib.sha256).digest()
+        # 获取signingKey对应的HMAC
+        signing_hmac = self._signing_hmac(secret_access_key, amz_date[:8], region, service)
         
         # 生成StringToSign
         string_to_sign_arr = [
@@ -299,17 +596,23 @@ class JimengApiClient:
             amz_date,
             self._credential_string(amz_date, region, service),
             hashlib.sha256(
-                self._canonical_string(request_method, request_params, request_headers, request_body).encode('utf-8')
+                self._canonical_string(
+                    request_method, request_params, request_headers, request_body,
+                    payload_hash, canonical_query_string
+                ).encode('utf-8')
             ).hexdigest(),
         ]
         string_to_sign = '\n'.join(string_to_sign_arr)
         
-        return hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        signature = signing_hmac.copy()
+        signature.update(string_to_sign.encode('utf-8'))
+        return signature.hexdigest()
     
     def _generate_authorization_and_header(self, access_key_id: str, secret_access_key: str,
                                          session_token: str, region: str, service: str,
                                          request_method: str, request_params: Dict,
-                                         request_body: Dict = None) -> Dict:
+                                         request_body: Dict = None,
+                                         canonical_query_string: Optional[str] = None) -> Dict:
         """生成请求所需Header和Authorization"""
         # 获取当前ISO时间
         now = time.gmtime()
@@ -318,14 +621,17 @@ class JimengApiClient:
         if request_body is None:
             request_body = {}
         
+        # 请求体摘要只计算一次，Header 与 canonicalString 共用
+        payload_hash = self._payload_hash(request_body)
+        
         # 生成请求的Header
-        request_headers = self._add_headers(amz_date, session_token, request_body)
+        request_headers = self._add_headers(amz_date, session_token, request_body, payload_hash)
         
         # 生成Authorization
         authorization_params = [
             f'AWS4-HMAC-SHA256 Credential={access_key_id}/{self._credential_string(amz_date, region, service)}',
             f'SignedHeaders={self._signed_headers(request_headers)}',
-            f'Signature={self._signature(secret_access_key, amz_date, region, service, request_method, request_params, request_headers, request_body)}',
+            f'Signature={self._signature(secret_access_key, amz_date, region, service, request_method, request_params, request_headers, request_body, payload_hash, canonical_query_string)}',
         ]
         authorization = ', '.join(authorization_params)
         
@@ -343,18 +649,23 @@ class JimengApiClient:
             # 获取图片数据
             image_data = self._get_file_content(file_path)
             
-            # 计算CRC32
-            crc32_func = crcmod.mkCrcFun(0x104c11db7, initCrc=0, xorOut=0xFFFFFFFF)
-            image_crc32 = hex(crc32_func(image_data))[2:]
+            # 计算CRC32（标准 IEEE CRC-32，与 crcmod 的 crc-32 一致）
+            if isinstance(image_data, bytes):
+                file_size = len(image_data)
+                crc32 = zlib.crc32(image_data) & 0xFFFFFFFF
+            else:
+                file_size, crc32 = self._file_size_and_crc32(image_data)
+            image_crc32 = format(crc32, 'x')
             
             # 获取图片上传凭证签名所需参数
             get_upload_image_proof_request_params = {
                 'Action': 'ApplyImageUpload',
-                'FileSize': len(image_data),
+                'FileSize': file_size,
                 'ServiceId': 'tb4s082cfz',
                 'Version': '2018-08-01',
                 's': self._generate_random_string(11),
             }
+            apply_query_string = self._canonical_query_string(get_upload_image_proof_request_params)
             
             # 获取图片上传请求头
             request_headers_info = self._generate_authorization_and_header(
@@ -365,12 +676,13 @@ class JimengApiClient:
                 'imagex',
                 'GET',
                 get_upload_image_proof_request_params,
+                canonical_query_string=apply_query_string,
             )
             
             # 获取图片上传凭证
             upload_img_res = self._request(
                 'GET',
-                f"{self.upload_image_proof_url}?{urlencode(get_upload_image_proof_request_params)}",
+                f"{self.upload_image_proof_url}?{apply_query_string}",
                 {},
                 {},
                 request_headers_info
@@ -386,12 +698,18 @@ class JimengApiClient:
             
             # 上传图片
             upload_headers = {
+                **self.THIRD_PARTY_HEADERS,
                 'Authorization': upload_address['StoreInfos'][0]['Auth'],
                 'Content-Crc32': image_crc32,
                 'Content-Type': 'application/octet-stream',
             }
             
-            response = requests.post(upload_img_url, data=image_data, headers=upload_headers)
+            if isinstance(image_data, bytes):
+                response = self.session.post(upload_img_url, data=image_data, headers=upload_headers)
+            else:
+                # 本地文件以文件对象上传，由 requests 分块发送
+                with open(image_data, 'rb') as f:
+                    response = self.session.post(upload_img_url, data=f, headers=upload_headers)
             image_upload_res = response.json()
             
             if image_upload_res.get('code') != 2000:
@@ -400,10 +718,11 @@ class JimengApiClient:
             # 提交图片上传
             commit_img_params = {
                 'Action': 'CommitImageUpload',
-                'FileSize': len(image_data),
+                'FileSize': file_size,
                 'ServiceId': 'tb4s082cfz',
                 'Version': '2018-08-01',
             }
+            commit_query_string = self._canonical_query_string(commit_img_params)
             
             commit_img_content = {
                 'SessionKey': upload_address['SessionKey'],
@@ -418,6 +737,7 @@ class JimengApiClient:
                 'POST',
                 commit_img_params,
                 commit_img_content,
+                canonical_query_string=commit_query_string,
             )
             
             commit_img_head['Content-Type'] = 'application/json'
@@ -425,7 +745,7 @@ class JimengApiClient:
             # 提交图片上传
             commit_img = self._request(
                 'POST',
-                f"{self.upload_image_proof_url}?{urlencode(commit_img_params)}",
+                f"{self.upload_image_proof_url}?{commit_query_string}",
                 commit_img_content,
                 {},
                 commit_img_head
@@ -463,33 +783,36 @@ class JimengApiClient:
         has_file_path = bool(file_path)
         upload_id = None
         
+        # 积分查询（即梦域名）与上传（imagex 域名）、请求构建互不依赖，放到后台线程并行执行
+        credit_future = self._get_executor().submit(self.get_credit)
+        
         if has_file_path:
             upload_id = self._upload_cover_file(file_path)
         
         # 获取实际模型
-        model_name = self.DEFAULT_BLEND_MODEL if has_file_path else (model or self.DEFAULT_MODEL)
-        actual_model = self._get_model(model_name)
+        if has_file_path:
+            actual_model = self.DEFAULT_BLEND_MODEL_VALUE
+        else:
+            actual_model = self._get_model(model) if model else self.DEFAULT_MODEL_VALUE
         
-        # 检查积分
-        credit_info = self.get_credit()
-        if credit_info['total_credit'] <= 0:
-            self.receive_credit()
+        # 一次请求所需的全部ID从同一批随机数中生成
+        uuids = self._uuid_iter()
         
         # 生成组件ID
-        component_id = self._generate_uuid()
+        component_id = next(uuids)
         
         # 构建请求参数
         rq_params = {
-            "babi_param": quote(json.dumps({
+            "babi_param": self.BLEND_BABI_PARAM if has_file_path else quote(_json_dumps({
                 "scenario": "image_video_generation",
-                "feature_key": "to_image_referenceimage_generate" if has_file_path else "aigc_to_image",
+                "feature_key": "aigc_to_image",
                 "feature_entrance": "to_image",
-                "feature_entrance_detail": f"to_image-referenceimage-byte_edit" if has_file_path else f"to_image-{actual_model}",
+                "feature_entrance_detail": f"to_image-{actual_model}",
             })),
-            "aid": int(self.DEFAULT_ASSISTANT_ID),
+            "aid": self.ASSISTANT_AID,
             "device_platform": "web",
             "region": "CN",
-            "web_id": int(self.web_id)
+            "web_id": self.web_id
         }
         
         # 构建能力参数
@@ -497,33 +820,31 @@ class JimengApiClient:
             abilities = {
                 "blend": {
                     "type": "",
-                    "id": self._generate_uuid(),
+                    "id": next(uuids),
                     "min_features": [],
                     "core_param": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                         "model": actual_model,
                         "prompt": prompt + '##',
                         "sample_strength": sample_strength,
                         "image_ratio": 1,
                         "large_image_info": {
                             "type": "",
-                            "id": self._generate_uuid(),
-                            "height": 1360,
-                            "width": 1360,
-                            "resolution_type": '1k'
+                            "id": next(uuids),
+                            **self.BLEND_LARGE_IMAGE_INFO
                         }
                     },
                     "ability_list": [
                         {
                             "type": "",
-                            "id": self._generate_uuid(),
+                            "id": next(uuids),
                             "name": "byte_edit",
                             "image_uri_list": [upload_id],
                             "image_list": [
                                 {
                                     "type": "image",
-                                    "id": self._generate_uuid(),
+                                    "id": next(uuids),
                                     "source_from": "upload",
                                     "platform_type": 1,
                                     "name": "",
@@ -539,18 +860,18 @@ class JimengApiClient:
                     ],
                     "history_option": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                     },
                     "prompt_placeholder_info_list": [
                         {
                             "type": "",
-                            "id": self._generate_uuid(),
+                            "id": next(uuids),
                             "ability_index": 0
                         }
                     ],
                     "postedit_param": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                         "generate_type": 0
                     }
                 }
@@ -559,10 +880,10 @@ class JimengApiClient:
             abilities = {
                 "generate": {
                     "type": "",
-                    "id": self._generate_uuid(),
+                    "id": next(uuids),
                     "core_param": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                         "model": actual_model,
                         "prompt": prompt,
                         "negative_prompt": negative_prompt,
@@ -571,7 +892,7 @@ class JimengApiClient:
                         "image_ratio": 1,
                         "large_image_info": {
                             "type": "",
-                            "id": self._generate_uuid(),
+                            "id": next(uuids),
                             "height": height,
                             "width": width,
                             "resolution_type": '1k'
@@ -579,7 +900,7 @@ class JimengApiClient:
                     },
                     "history_option": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                     }
                 }
             }
@@ -590,10 +911,10 @@ class JimengApiClient:
                 "root_model": actual_model,
                 "template_id": "",
             },
-            "submit_id": self._generate_uuid(),
-            "draft_content": json.dumps({
+            "submit_id": next(uuids),
+            "draft_content": _json_dumps({
                 "type": "draft",
-                "id": self._generate_uuid(),
+                "id": next(uuids),
                 "min_version": self.DRAFT_VERSION,
                 "is_from_tsn": True,
                 "version": "3.2.2",
@@ -604,7 +925,7 @@ class JimengApiClient:
                     "min_version": self.DRAFT_VERSION,
                     "metadata": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                         "created_platform": 3,
                         "created_platform_version": "",
                         "created_time_in_ms": int(time.time() * 1000),
@@ -614,23 +935,21 @@ class JimengApiClient:
                     "aigc_mode": "workbench",
                     "abilities": {
                         "type": "",
-                        "id": self._generate_uuid(),
+                        "id": next(uuids),
                         **abilities
                     }
                 }]
-            }),
+            }).decode('utf-8'),
         }
         
         # 添加metrics_extra（仅限非混合模式）
         if not has_file_path:
-            rq_data["metrics_extra"] = json.dumps({
-                "templateId": "",
-                "generateCount": 1,
-                "promptSource": "custom",
-                "templateSource": "",
-                "lastRequestId": "",
-                "originRequestId": "",
-            })
+            rq_data["metrics_extra"] = self.METRICS_EXTRA
+        
+        # 检查积分
+        credit_info = credit_future.result()
+        if credit_info['total_credit'] <= 0:
+            self.receive_credit()
         
         # 发送生成请求
         result = self._request('POST', '/mweb/v1/aigc_draft/generate', rq_data, rq_params)
@@ -641,39 +960,32 @@ class JimengApiClient:
             error_msg = result.get('errmsg', '记录ID不存在')
             raise Exception(error_msg)
         
-        # 轮询获取结果
+        # 轮询请求体在本次生成中不变，只序列化一次
+        history_body = _json_dumps({
+            "history_ids": [history_id],
+            "image_info": self.HISTORY_IMAGE_INFO,
+            "http_common_info": self.HISTORY_COMMON_INFO
+        })
+        
+        # 轮询获取结果，间隔按指数退避增长；设置了 POLL_TIMEOUT 时总时长不超过该值
         status = 20
         fail_code = None
         item_list = []
+        interval = self.POLL_INITIAL_INTERVAL
+        deadline = None if self.POLL_TIMEOUT is None else time.monotonic() + self.POLL_TIMEOUT
         
         while status == 20:
-            time.sleep(1) # 如果报错，可适当调高间隔时长
+            wait = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'图像生成超时: 等待超过 {self.POLL_TIMEOUT:g} 秒, 记录ID: {history_id}')
+                wait = min(interval, remaining)
             
-            result = self._request('POST', '/mweb/v1/get_history_by_ids', {
-                "history_ids": [history_id],
-                "image_info": {
-                    "width": 2048,
-                    "height": 2048,
-                    "format": "webp",
-                    "image_scene_list": [
-                        {"scene": "smart_crop", "width": 360, "height": 360, "uniq_key": "smart_crop-w:360-h:360", "format": "webp"},
-                        {"scene": "smart_crop", "width": 480, "height": 480, "uniq_key": "smart_crop-w:480-h:480", "format": "webp"},
-                        {"scene": "smart_crop", "width": 720, "height": 720, "uniq_key": "smart_crop-w:720-h:720", "format": "webp"},
-                        {"scene": "smart_crop", "width": 720, "height": 480, "uniq_key": "smart_crop-w:720-h:480", "format": "webp"},
-                        {"scene": "smart_crop", "width": 360, "height": 240, "uniq_key": "smart_crop-w:360-h:240", "format": "webp"},
-                        {"scene": "smart_crop", "width": 240, "height": 320, "uniq_key": "smart_crop-w:240-h:320", "format": "webp"},
-                        {"scene": "smart_crop", "width": 480, "height": 640, "uniq_key": "smart_crop-w:480-h:640", "format": "webp"},
-                        {"scene": "normal", "width": 2400, "height": 2400, "uniq_key": "2400", "format": "webp"},
-                        {"scene": "normal", "width": 1080, "height": 1080, "uniq_key": "1080", "format": "webp"},
-                        {"scene": "normal", "width": 720, "height": 720, "uniq_key": "720", "format": "webp"},
-                        {"scene": "normal", "width": 480, "height": 480, "uniq_key": "480", "format": "webp"},
-                        {"scene": "normal", "width": 360, "height": 360, "uniq_key": "360", "format": "webp"}
-                    ]
-                },
-                "http_common_info": {
-                    "aid": int(self.DEFAULT_ASSISTANT_ID)
-                }
-            })
+            time.sleep(wait) # 如果报错，可适当调高间隔时长
+            interval = min(interval * self.POLL_BACKOFF_FACTOR, self.POLL_MAX_INTERVAL)
+            
+            result = self._request('POST', '/mweb/v1/get_history_by_ids', history_body, idempotent=True)
             
             record = result.get('data', {}).get(history_id)
             if not record: